@@ -31,74 +31,127 @@ __version__ = "1.0"
 
 import argparse
 import random
-import re
+import string
 import sys
 
+# Characters allowed in a person's id, the others are stripped from the name
+_ID_CHARS = frozenset(string.ascii_letters + string.digits)
+
+def _parse_attributes(attrs):
+	"""Parses a comma-separated list of attributes ("key=value" or "flag")
+	and returns them as a dictionnary.
+
+	"""
+	attr = {}
+	for a in attrs.split(','):
+		a = a.strip()
+		if '=' in a:
+			k, v = a.split('=')
+			attr[k] = v
+		else:
+			attr[a] = True
+	return attr
+
+# Attributes of the input file that are stored on persons, and the slots
+# they are stored in
+_ATTR_SLOTS = {
+	'surname': 'surname',
+	'birthday': 'birthday',
+	'deathday': 'deathday',
+	'notes': 'notes',
+	'F': 'is_female',
+	'M': 'is_male',
+}
+
 class Person:
 	"""This class represents a person.
 
 	Characteristics:
 	- name			real name of the person
 	- id			unique ID to be distinguished in a dictionnary
-	- attr			attributes (e.g. gender, birth date...)
+	- surname, birthday, deathday, notes, is_female, is_male
+					attributes given in the input file, None when not set
 	- households	list of households this person belongs to
 	- follow_kids	boolean to tell the algorithm to display this person's
 					descendent or not
 
 	"""
 
+	__slots__ = ('name', 'id', 'parents', 'households', '_household_ids',
+				 'follow_kids', 'surname', 'birthday', 'deathday', 'notes',
+				 'is_female', 'is_male', '_gv')
+
 	def __init__(self, desc):
-		self.attr = {}
 		self.parents = []
 		self.households = []
+		self._household_ids = set()
 
 		desc = desc.strip()
-		if '(' in desc and ')' in desc:
-			self.name, attr = desc[0:-1].split('(')
-			self.name = self.name.strip()
-			attr = map(lambda x: x.strip(), attr.split(','))
-			for a in attr:
-				if '=' in a:
-					k, v = a.split('=')
-					self.attr[k] = v
-				else:
-					self.attr[a] = True
+		# Attributes are given between parentheses after the name, e.g.
+		# "Louis XIV (M, birthday=1638)"
+		i = desc.find('(')
+		if i != -1 and desc.endswith(')'):
+			self.name = desc[:i].strip()
+			attr = _parse_attributes(desc[i+1:-1])
 		else:
 			self.name = desc
+			attr = {}
 
-		if 'id' in self.attr:
-			  self.id = self.attr['id']
+		if 'id' in attr:
+			  self.id = attr['id']
 		else:
-			self.id = re.sub('[^0-9A-Za-z]', '', self.name)
-			if 'unique' in self.attr:
+			self.id = self.name.translate({ord(c): None for c in set(self.name)
+										   if c not in _ID_CHARS})
+			if 'unique' in attr:
 				  self.id += str(random.randint(100, 999))
 
+		# Other attributes than the known ones are not used, hence ignored
+		for k, slot in _ATTR_SLOTS.items():
+			setattr(self, slot, attr.get(k))
 		self.follow_kids = True
+		self._gv = None
 
 	def __str__(self):
 		return self.name
 
+	def update(self, other):
+		"""Updates the attributes of this person with those set on 'other'.
+
+		"""
+		for slot in _ATTR_SLOTS.values():
+			v = getattr(other, slot)
+			if v is not None:
+				setattr(self, slot, v)
+		self._gv = None
+
 	def dump(self):
-		return	'Person: %s (%s)\n' % (self.name, str(self.attr)) + \
+		attr = {k: getattr(self, slot) for k, slot in _ATTR_SLOTS.items()
+				if getattr(self, slot) is not None}
+		return	'Person: %s (%s)\n' % (self.name, str(attr)) + \
 				'  %d households' % len(self.households)
 
 	def graphviz(self):
-		label = self.name
-		if 'surname' in self.attr:
-			label += '\\n« ' + str(self.attr['surname']) + '»'
-		if 'birthday' in self.attr:
-			label += '\\n' + str(self.attr['birthday'])
-			if 'deathday' in self.attr:
-				label += ' † ' + str(self.attr['deathday'])
-		elif 'deathday' in self.attr:
-			label += '\\n† ' + str(self.attr['deathday'])
-		if 'notes' in self.attr:
-			label += '\\n' + str(self.attr['notes'])
-		opts = ['label="' + label + '"']
-		opts.append('style=filled')
-		opts.append('fillcolor=' + ('F' in self.attr and 'bisque' or
-					('M' in self.attr and 'azure2' or 'white')))
-		return self.id + '[' + ','.join(opts) + ']'
+		if self._gv is not None:
+			return self._gv
+
+		parts = [self.name]
+		if self.surname is not None:
+			parts.append('« ' + str(self.surname) + '»')
+		if self.birthday is not None:
+			if self.deathday is not None:
+				parts.append(str(self.birthday) + ' † ' + str(self.deathday))
+			else:
+				parts.append(str(self.birthday))
+		elif self.deathday is not None:
+			parts.append('† ' + str(self.deathday))
+		if self.notes is not None:
+			parts.append(str(self.notes))
+		label = '\\n'.join(parts)
+		fill = 'bisque' if self.is_female is not None else \
+			   ('azure2' if self.is_male is not None else 'white')
+		self._gv = self.id + '[label="' + label + '",style=filled,' + \
+				   'fillcolor=' + fill + ']'
+		return self._gv
 
 class Household:
 	"""This class represents a household, i.e. a union of two person.
@@ -115,8 +168,8 @@ class Household:
 	
 	def __str__(self):
 		return	'Family:\n' + \
-				'\tparents  = ' + ', '.join(map(str, self.parents)) + '\n' \
-				'\tchildren = ' + ', '.join(map(str, self.kids))
+				'\tparents  = ' + ', '.join(p.name for p in self.parents) + \
+				'\n\tchildren = ' + ', '.join(k.name for k in self.kids)
 
 	def isempty(self):
 		if len(self.parents) == 0 and len(self.kids) == 0:
@@ -128,14 +181,19 @@ class Family:
 
 	'everybody' contains all persons, indexed by their unique id
 	'households' is the list of all unions (with or without children)
+	'by_name' indexes persons by their name (the first one met for each name)
+	'_out' buffers the lines of the DOT output before writing them
 
 	"""
 
-	everybody = {}
-	households = []
-
 	invisible = '[shape=circle,label="",height=0.01,width=0.01]';
 
+	def __init__(self):
+		self.everybody = {}
+		self.households = []
+		self.by_name = {}
+		self._out = []
+
 	def add_person(self, string):
 		"""Adds a person to self.everybody, or update his/her info if this
 		person already exists.
@@ -145,9 +203,10 @@ class Family:
 		key = p.id
 
 		if key in self.everybody:
-			self.everybody[key].attr.update(p.attr)
+			self.everybody[key].update(p)
 		else:
 			self.everybody[key] = p
+			self.by_name.setdefault(p.name, p)
 
 		return self.everybody[key]
 
@@ -164,48 +223,42 @@ class Family:
 		self.households.append(h)
 
 		for p in h.parents:
-			if not h in p.households:
+			if not h.id in p._household_ids:
+				p._household_ids.add(h.id)
 				p.households.append(h)
 
 	def find_person(self, name):
 		"""Tries to find a person matching the 'name' argument.
 
 		"""
-		# First, search in ids
-		if name in self.everybody:
-			return self.everybody[name]
-		# Ancestor not found in 'id', maybe it's in the 'name' field?
-		for p in self.everybody.values():
-			if p.name == name:
-				return p
-		return None
-		
+		# First, search in ids, then in the 'name' field
+		return self.everybody.get(name) or self.by_name.get(name)
+
 	def populate(self, f):
 		"""Reads the input file line by line, to find persons and unions.
 
 		"""
+		add_person = self.add_person
 		h = Household()
-		while True:
-			line = f.readline()
-			if line == '': # end of file
-				if not h.isempty():
-					self.add_household(h)
-				break
+		for line in f:
 			line = line.rstrip()
-			if line == '':
+			if not line:
 				if not h.isempty():
 					self.add_household(h)
 				h = Household()
 			elif line[0] == '#':
 				continue
+			elif line[0] == '\t':
+				p = add_person(line[1:])
+				p.parents = h.parents
+				h.kids.append(p)
 			else:
-				if line[0] == '\t':
-					p = self.add_person(line[1:])
-					p.parents = h.parents
-					h.kids.append(p)
-				else:
-					p = self.add_person(line)
-					h.parents.append(p)
+				p = add_person(line)
+				h.parents.append(p)
+
+		# End of file
+		if not h.isempty():
+			self.add_household(h)
 
 	def find_first_ancestor(self):
 		"""Returns the first ancestor found.
@@ -222,124 +275,139 @@ class Family:
 				return p
 
 	def next_generation(self, gen):
-		"""Takes the generation N in argument, returns the generation N+1.
+		"""Takes the generation N in argument, yields the persons of the
+		generation N+1.
 
 		Generations are represented as a list of persons.
 
 		"""
-		next_gen = []
-
 		for p in gen:
 			if not p.follow_kids:
 				continue
 			for h in p.households:
-				next_gen.extend(h.kids)
-				# append mari/femme
-
-		return next_gen
+				yield from h.kids
 
+	@staticmethod
 	def get_spouse(household, person):
 		"""Returns the spouse or husband of a person in a union.
 
 		"""
-		return	household.parents[0] == person \
-				and household.parents[1] or household.parents[0]
+		parents = household.parents
+		return parents[1] if parents[0] is person else parents[0]
 
 	def display_generation(self, gen):
 		"""Outputs an entire generation in DOT format.
 
 		"""
-		# Display persons
-		print('\t{ rank=same;')
-
-		prev = None
+		# Walk the generation only once, filling the persons rank, the rank
+		# of lines below households and the edges to kids at the same time
+		rank_persons = []
+		rank_kids = []
+		edges = []
+
+		prev_person = None
+		prev_kid = None
 		for p in gen:
-			l = len(p.households)
+			hs = p.households
+			l = len(hs)
 
-			if prev:
+			# Display persons
+			if prev_person:
 				if l <= 1:
-					print('\t\t%s -> %s [style=invis];' % (prev, p.id))
+					rank_persons.append('\t\t%s -> %s [style=invis];'
+										% (prev_person, p.id))
 				else:
-					print('\t\t%s -> %s [style=invis];'
-						  % (prev, Family.get_spouse(p.households[0], p).id))
+					parents = hs[0].parents
+					spouse = parents[1] if parents[0] is p else parents[0]
+					rank_persons.append('\t\t%s -> %s [style=invis];'
+										% (prev_person, spouse.id))
 
 			if l == 0:
-				prev = p.id
+				prev_person = p.id
 				continue
-			elif len(p.households) > 2:
+			elif l > 2:
 				raise Exception('Person "' + p.name + '" has more than 2 ' +
 								'spouses/husbands: drawing this is not ' +
 								'implemented')
 
-			# Display those on the left (if any)
-			for i in range(0, int(l/2)):
-				h = p.households[i]
-				spouse = Family.get_spouse(h, p)
-				print('\t\t%s -> h%d -> %s;' % (spouse.id, h.id, p.id))
-				print('\t\th%d%s;' % (h.id, Family.invisible))
-
-			# Display those on the right (at least one)
-			for i in range(int(l/2), l):
-				h = p.households[i]
-				spouse = Family.get_spouse(h, p)
-				print('\t\t%s -> h%d -> %s;' % (p.id, h.id, spouse.id))
-				print('\t\th%d%s;' % (h.id, Family.invisible))
-				prev = spouse.id
-		print('\t}')
-
-		# Display lines below households
-		print('\t{ rank=same;')
-		prev = None
-		for p in gen:
-			for h in p.households:
-				if len(h.kids) == 0:
+			for i, h in enumerate(hs):
+				# (same as Family.get_spouse(h, p), inlined)
+				parents = h.parents
+				spouse = parents[1] if parents[0] is p else parents[0]
+				if i < l >> 1:
+					# Display those on the left (if any)
+					rank_persons.append('\t\t%s -> h%d -> %s;'
+										% (spouse.id, h.id, p.id))
+				else:
+					# Display those on the right (at least one)
+					rank_persons.append('\t\t%s -> h%d -> %s;'
+										% (p.id, h.id, spouse.id))
+					prev_person = spouse.id
+				rank_persons.append('\t\th%d%s;' % (h.id, Family.invisible))
+
+				n = len(h.kids)
+				if n == 0:
 					continue
-				if prev:
-					print('\t\t%s -> h%d_0 [style=invis];' % (prev, h.id))
-				l = len(h.kids)
-				if l % 2 == 0:
-					# We need to add a node to keep symmetry
-					l += 1
-				print('\t\t' + ' -> '.join(map(lambda x: 'h%d_%d' % (h.id, x), range(l))) + ';')
-				for i in range(l):
-					print('\t\th%d_%d%s;' % (h.id, i, Family.invisible))
-					prev = 'h%d_%d' % (h.id, i)
-		print('\t}')
 
-		for p in gen:
-			for h in p.households:
-				if len(h.kids) > 0:
-					print('\t\th%d -> h%d_%d;'
-					      % (h.id, h.id, int(len(h.kids)/2)))
-					i = 0
-					for c in h.kids:
-						print('\t\th%d_%d -> %s;'
-						      % (h.id, i, c.id))
-						i += 1
-						if i == len(h.kids)/2:
-							i += 1
+				# Display lines below households
+				if prev_kid:
+					rank_kids.append('\t\t%s -> h%d_0 [style=invis];'
+									 % (prev_kid, h.id))
+				m = n
+				if m % 2 == 0:
+					# We need to add a node to keep symmetry
+					m += 1
+				rank_kids.append('\t\t' +
+								 ' -> '.join('h%d_%d' % (h.id, x)
+											 for x in range(m)) + ';')
+				for x in range(m):
+					rank_kids.append('\t\th%d_%d%s;'
+									 % (h.id, x, Family.invisible))
+				prev_kid = 'h%d_%d' % (h.id, m - 1)
+
+				# Display edges from households to kids
+				edges.append('\t\th%d -> h%d_%d;' % (h.id, h.id, n >> 1))
+				x = 0
+				for c in h.kids:
+					edges.append('\t\th%d_%d -> %s;' % (h.id, x, c.id))
+					x += 1
+					# Skip the middle node added for symmetry
+					if x * 2 == n:
+						x += 1
+
+		out = self._out.extend
+		out(['\t{ rank=same;'] + rank_persons + ['\t}'])
+		out(['\t{ rank=same;'] + rank_kids + ['\t}'])
+		out(edges)
 
 	def output_descending_tree(self, ancestor):
 		"""Outputs the whole descending family tree from a given ancestor,
 		in DOT format.
 
 		"""
+		self._out = []
+		out = self._out.append
+
 		# Find the first households
 		gen = [ancestor]
 
-		print('digraph {\n' + \
-		      '\tnode [shape=box];\n' + \
-		      '\tedge [dir=none];\n')
+		out('digraph {\n' + \
+		    '\tnode [shape=box];\n' + \
+		    '\tedge [dir=none];\n')
 
 		for p in self.everybody.values():
-			print('\t' + p.graphviz() + ';')
-		print('')
+			out('\t' + p.graphviz() + ';')
+		out('')
 
 		while gen:
 			self.display_generation(gen)
-			gen = self.next_generation(gen)
+			gen = list(self.next_generation(gen))
+
+		out('}')
 
-		print('}')
+		# Write everything at once rather than line by line
+		sys.stdout.write('\n'.join(self._out) + '\n')
+		self._out = []
 
 def main():
 	"""Entry point of the program when called as a script.
@@ -358,8 +426,8 @@ def main():
 	# Create the family
 	family = Family()
 
-	# Populate the family
-	f = open(args.input, 'r', encoding='utf-8')
+	# Populate the family, reading the input file in large chunks
+	f = open(args.input, 'r', encoding='utf-8', buffering=1 << 20)
 	family.populate(f)
 	f.close()
 